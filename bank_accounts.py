@@ -5,56 +5,219 @@ Bank Account Management System
 Handles multiple bank account connections and access tokens
 """
 
-import json
+import io
 import os
+import re
+import sys
+import mmap
+import time
 import datetime
+from contextlib import contextmanager
 from typing import List, Dict, Optional
-from plaid import Configuration, ApiClient
-from plaid.api import plaid_api
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.item_get_request import ItemGetRequest
+import orjson
+
+# Sheet-name cleaning in one pass: a run of whitespace (plus any special
+# characters touching it) becomes one space, other special characters are dropped
+_SHEET_NAME_CLEAN_RE = re.compile(r'(?P<ws>[^\w\s-]*\s[^\w-]*)|[^\w\s-]+')
+
+def _clean_sheet_name_match(match):
+    return ' ' if match.group('ws') is not None else ''
+
+# Second-granularity ISO timestamp, formatted at most once per wall-clock second
+_last_ts_sec = 0
+_last_ts_str = ''
+
+def _now_iso() -> str:
+    """Current local time as an ISO string, reusing the formatted value within a second"""
+    global _last_ts_sec, _last_ts_str
+    now_sec = int(time.time())
+    if now_sec != _last_ts_sec:
+        _last_ts_sec = now_sec
+        _last_ts_str = datetime.datetime.fromtimestamp(now_sec).isoformat()
+    return _last_ts_str
 
 class BankAccountManager:
+    # Compact the journal into the base file once it grows past this many records
+    COMPACT_THRESHOLD = 100
+
     def __init__(self, plaid_client):
         self.plaid_client = plaid_client
         self.accounts_file = '_bank_accounts.json'
+        self.log_file = self.accounts_file + '.log'
+        self._log_f = None
+        self._log_lines = 0
+        self._bulk_depth = 0
         self.accounts = self._load_accounts()
+        self._build_columns()
+        if self._log_lines > self.COMPACT_THRESHOLD:
+            self._save_accounts()
     
     def _load_accounts(self) -> Dict:
-        """Load bank accounts from file"""
+        """Load bank accounts from file and replay the journal on top"""
+        accounts = {}
         try:
-            if os.path.exists(self.accounts_file):
-                with open(self.accounts_file, 'r') as f:
-                    return json.load(f)
-            return {}
+            if os.path.exists(self.accounts_file) and os.path.getsize(self.accounts_file) > 0:
+                # Map the file and parse straight from the page cache
+                with open(self.accounts_file, 'rb') as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            accounts = orjson.loads(view)
         except Exception as e:
             print(f"[ERROR] Error loading bank accounts: {e}")
             return {}
+        
+        try:
+            if os.path.exists(self.log_file):
+                with open(self.log_file, 'rb') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            record = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            # Torn write at the tail of the journal; ignore it
+                            continue
+                        self._apply_record(accounts, record)
+                        self._log_lines += 1
+        except Exception as e:
+            print(f"[ERROR] Error replaying bank accounts journal: {e}")
+        
+        return accounts
+    
+    def _build_columns(self):
+        """Build column views of self.accounts for traversals that need only a field or two"""
+        # Parallel lists, in self.accounts order
+        self._ids = list(self.accounts)
+        self._tokens = [acc['access_token'] for acc in self.accounts.values()]
+        self._names = [acc['account_name'] for acc in self.accounts.values()]
+        # Sheet names in use, for O(1) uniqueness checks
+        self._sheet_names = {acc.get('sheet_name', '') for acc in self.accounts.values()}
+        # Institution names we already know, so re-linking a bank skips item_get
+        self._institution_names = {
+            acc['institution_id']: acc['institution_name']
+            for acc in self.accounts.values() if acc.get('institution_id')
+        }
+    
+    @staticmethod
+    def _apply_record(accounts: Dict, record: Dict):
+        """Apply a single journal record to the accounts dict"""
+        op = record.get('op')
+        account_id = record.get('id')
+        if op == 'set':
+            accounts[account_id] = record['data']
+        elif op == 'del':
+            accounts.pop(account_id, None)
+        elif op == 'lastsync' and account_id in accounts:
+            accounts[account_id]['last_sync'] = record['ts']
+        elif op == 'cursor' and account_id in accounts:
+            accounts[account_id]['sync_cursor'] = record['cursor']
+        elif op == 'window' and account_id in accounts:
+            accounts[account_id]['sync_window_start'] = record['date']
+    
+    def _append_log(self, record: Dict, flush: bool = True):
+        """Append a delta record to the journal instead of rewriting the base file"""
+        try:
+            if self._log_f is None:
+                self._log_f = open(self.log_file, 'ab', buffering=1 << 16)
+            self._log_f.write(orjson.dumps(record) + b'\n')
+            self._log_lines += 1
+            if flush and not self._bulk_depth:
+                self._log_f.flush()
+        except Exception as e:
+            print(f"[ERROR] Error writing bank accounts journal: {e}")
+    
+    @contextmanager
+    def bulk(self):
+        """Batch several mutations: journal writes are buffered and persisted once at the end"""
+        self._bulk_depth += 1
+        try:
+            yield self
+        finally:
+            self._bulk_depth -= 1
+            if self._bulk_depth == 0:
+                if self._log_lines > self.COMPACT_THRESHOLD:
+                    self._save_accounts()
+                else:
+                    self.flush()
+    
+    def flush(self):
+        """Flush buffered journal records to disk (call once per sync run)"""
+        if self._log_f is not None:
+            try:
+                self._log_f.flush()
+                # Durability is deferred to here instead of every write
+                os.fsync(self._log_f.fileno())
+            except Exception as e:
+                print(f"[ERROR] Error flushing bank accounts journal: {e}")
+    
+    def _fsync_dir(self):
+        """Persist a rename in the accounts file's directory (not supported on Windows)"""
+        try:
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.accounts_file)), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
     
     def _save_accounts(self):
-        """Save bank accounts to file"""
+        """Compact accounts into the base file and truncate the journal"""
+        tmp_file = self.accounts_file + '.tmp'
         try:
-            with open(self.accounts_file, 'w') as f:
-                json.dump(self.accounts, f, indent=2)
+            with open(tmp_file, 'wb') as f:
+                f.write(orjson.dumps(self.accounts, option=orjson.OPT_INDENT_2))
+                # The journal is truncated below, so the new base file must be
+                # on disk before it replaces the old one
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.accounts_file)
+            self._fsync_dir()
+            
+            if self._log_f is not None:
+                self._log_f.close()
+                self._log_f = None
+            open(self.log_file, 'w').close()
+            self._log_lines = 0
         except Exception as e:
             print(f"[ERROR] Error saving bank accounts: {e}")
+            # The previous base file is untouched; just drop the partial temp file
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
     
     def add_account(self, access_token: str, account_name: str = None) -> bool:
         """Add a new bank account"""
+        # Plaid models are only needed when linking, so keep them off the import path
+        from plaid.model.accounts_get_request import AccountsGetRequest
+        from plaid.model.item_get_request import ItemGetRequest
+        
         try:
             # Get account information from Plaid
             accounts_req = AccountsGetRequest(access_token=access_token)
             accounts_resp = self.plaid_client.accounts_get(accounts_req)
             
-            # Get item information
-            item_req = ItemGetRequest(access_token=access_token)
-            item_resp = self.plaid_client.item_get(item_req)
+            # Get institution name, only asking Plaid for the item if it's a new institution
+            institution_id = accounts_resp.item.get('institution_id')
+            institution_name = self._institution_names.get(institution_id) if institution_id else None
+            if institution_name is None:
+                item_req = ItemGetRequest(access_token=access_token)
+                item_resp = self.plaid_client.item_get(item_req)
+                institution_name = item_resp.item.institution_name
+                if institution_id:
+                    self._institution_names[institution_id] = institution_name
             
-            # Generate account ID
-            account_id = f"account_{len(self.accounts) + 1}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            # Generate account ID (one clock read, shared with created_at)
+            now = datetime.datetime.now().replace(microsecond=0)
+            stamp = now.strftime('%Y%m%d_%H%M%S')
+            number = len(self.accounts) + 1
+            # Removing an account and adding one in the same second would reuse the ID
+            while f"account_{number}_{stamp}" in self.accounts:
+                number += 1
+            account_id = f"account_{number}_{stamp}"
             
             # Generate sheet name (clean and safe for Google Sheets)
-            institution_name = item_resp.item.institution_name
             sheet_name = self._generate_sheet_name(institution_name, account_name)
             
             # Store account data
@@ -62,6 +225,7 @@ class BankAccountManager:
                 'access_token': access_token,
                 'account_name': account_name or f"Bank Account {len(self.accounts) + 1}",
                 'institution_name': institution_name,
+                'institution_id': institution_id,
                 'sheet_name': sheet_name,
                 'accounts': [
                     {
@@ -73,12 +237,16 @@ class BankAccountManager:
                     }
                     for acc in accounts_resp.accounts
                 ],
-                'created_at': datetime.datetime.now().isoformat(),
+                'created_at': now.isoformat(),
                 'last_sync': None
             }
             
             self.accounts[account_id] = account_data
-            self._save_accounts()
+            self._ids.append(account_id)
+            self._tokens.append(access_token)
+            self._names.append(account_data['account_name'])
+            self._sheet_names.add(sheet_name)
+            self._append_log({'op': 'set', 'id': account_id, 'data': account_data})
             
             print(f"[OK] Added account: {account_data['account_name']} ({account_data['institution_name']})")
             print(f"     Account ID: {account_id}")
@@ -97,16 +265,14 @@ class BankAccountManager:
         base_name = account_name or institution_name
         
         # Clean the name for Google Sheets (max 100 chars, no special chars)
-        import re
-        clean_name = re.sub(r'[^\w\s-]', '', base_name)
-        clean_name = re.sub(r'\s+', ' ', clean_name).strip()
+        clean_name = _SHEET_NAME_CLEAN_RE.sub(_clean_sheet_name_match, base_name).strip()
         
         # Truncate if too long
         if len(clean_name) > 100:
             clean_name = clean_name[:97] + "..."
         
         # Ensure uniqueness
-        existing_sheets = [acc.get('sheet_name', '') for acc in self.accounts.values()]
+        existing_sheets = self._sheet_names
         if clean_name in existing_sheets:
             counter = 1
             original_name = clean_name
@@ -120,8 +286,11 @@ class BankAccountManager:
         """Remove a bank account"""
         if account_id in self.accounts:
             account_name = self.accounts[account_id]['account_name']
+            self._sheet_names.discard(self.accounts[account_id].get('sheet_name', ''))
+            index = self._ids.index(account_id)
+            del self._ids[index], self._tokens[index], self._names[index]
             del self.accounts[account_id]
-            self._save_accounts()
+            self._append_log({'op': 'del', 'id': account_id})
             print(f"[OK] Removed account: {account_name}")
             return True
         else:
@@ -134,16 +303,19 @@ class BankAccountManager:
             print("[INFO] No bank accounts linked")
             return []
         
-        print("\n=== Linked Bank Accounts ===")
+        # Build the whole listing and write it in one call
+        buf = io.StringIO()
+        buf.write("\n=== Linked Bank Accounts ===\n")
         for account_id, account_data in self.accounts.items():
-            print(f"\nAccount ID: {account_id}")
-            print(f"Name: {account_data['account_name']}")
-            print(f"Institution: {account_data['institution_name']}")
-            print(f"Created: {account_data['created_at']}")
-            print(f"Last Sync: {account_data.get('last_sync', 'Never')}")
-            print(f"Linked Accounts:")
+            buf.write(f"\nAccount ID: {account_id}\n")
+            buf.write(f"Name: {account_data['account_name']}\n")
+            buf.write(f"Institution: {account_data['institution_name']}\n")
+            buf.write(f"Created: {account_data['created_at']}\n")
+            buf.write(f"Last Sync: {account_data.get('last_sync', 'Never')}\n")
+            buf.write("Linked Accounts:\n")
             for acc in account_data['accounts']:
-                print(f"  - {acc['name']} ({acc['type']}) ****{acc['mask']}")
+                buf.write(f"  - {acc['name']} ({acc['type']}) ****{acc['mask']}\n")
+        sys.stdout.write(buf.getvalue())
         
         return list(self.accounts.values())
     
@@ -155,30 +327,61 @@ class BankAccountManager:
     
     def get_all_access_tokens(self) -> List[tuple]:
         """Get all access tokens with their account info"""
-        return [
-            (account_id, account_data['access_token'], account_data['account_name'])
-            for account_id, account_data in self.accounts.items()
-        ]
+        return list(zip(self._ids, self._tokens, self._names))
     
     def update_last_sync(self, account_id: str):
         """Update last sync timestamp for an account"""
         if account_id in self.accounts:
-            self.accounts[account_id]['last_sync'] = datetime.datetime.now().isoformat()
-            self._save_accounts()
+            timestamp = _now_iso()
+            self.accounts[account_id]['last_sync'] = timestamp
+            # Buffered; callers flush once at the end of a sync run
+            self._append_log({'op': 'lastsync', 'id': account_id, 'ts': timestamp}, flush=False)
+    
+    def get_sync_cursor(self, account_id: str) -> Optional[str]:
+        """Get the Plaid /transactions/sync cursor for an account (None before the first sync)"""
+        if account_id in self.accounts:
+            return self.accounts[account_id].get('sync_cursor')
+        return None
+    
+    def update_sync_cursor(self, account_id: str, cursor: str):
+        """Store the Plaid /transactions/sync cursor for an account"""
+        if account_id in self.accounts:
+            self.accounts[account_id]['sync_cursor'] = cursor
+            # Buffered; callers flush once at the end of a sync run
+            self._append_log({'op': 'cursor', 'id': account_id, 'cursor': cursor}, flush=False)
+    
+    def get_sync_window_start(self, account_id: str) -> Optional[datetime.date]:
+        """Get the earliest transaction date synced for an account (None before the first sync)"""
+        if account_id in self.accounts:
+            window_start = self.accounts[account_id].get('sync_window_start')
+            if window_start:
+                return datetime.date.fromisoformat(window_start)
+        return None
+    
+    def update_sync_window_start(self, account_id: str, window_start: datetime.date):
+        """Store the earliest transaction date to sync for an account"""
+        if account_id in self.accounts:
+            self.accounts[account_id]['sync_window_start'] = window_start.isoformat()
+            # Buffered; callers flush once at the end of a sync run
+            self._append_log({'op': 'window', 'id': account_id, 'date': window_start.isoformat()}, flush=False)
     
     def get_account_info(self, account_id: str) -> Optional[Dict]:
         """Get account information"""
         return self.accounts.get(account_id)
     
-    def migrate_legacy_token(self) -> bool:
-        """Migrate legacy single access token to new system"""
+    def migrate_legacy_token(self, legacy_data: Optional[Dict] = None) -> bool:
+        """Migrate legacy single access token to new system
+        
+        legacy_data is the already-parsed _access_token.json, if the caller has it
+        """
         legacy_file = '_access_token.json'
-        if not os.path.exists(legacy_file):
+        if legacy_data is None and not os.path.exists(legacy_file):
             return False
         
         try:
-            with open(legacy_file, 'r') as f:
-                legacy_data = json.load(f)
+            if legacy_data is None:
+                with open(legacy_file, 'rb') as f:
+                    legacy_data = orjson.loads(f.read())
             
             access_token = legacy_data.get('access_token')
             if not access_token:
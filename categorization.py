@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Transaction Categorization
+Business rules that assign a category and project to each transaction
+"""
+
+import functools
+import ahocorasick
+
+# ===================================================================
+# THE SUBCONTRACTOR DATABASE
+# Maps a keyword from the sub's name to their specific service.
+# This is our source of truth.
+# ===================================================================
+SUBCONTRACTOR_DATABASE = {
+    "all-pro plumbing":   {"service": "Plumbing"},
+    "j&l electric":       {"service": "Electrical"},
+    "sal's drywall":      {"service": "Drywall & Paint"},
+    "creative landscape": {"service": "Landscaping"},
+    "best quality roofing": {"service": "Roofing"},
+    "a-1 painting":       {"service": "Drywall & Paint"},
+    "precision framing":  {"service": "Framing"},
+    "elite concrete":     {"service": "Concrete & Foundation"},
+    "custom cabinetry":  {"service": "Cabinets & Millwork"},
+    "total home insulation": {"service": "Insulation"},
+    "flores tile & stone": {"service": "Flooring & Tile"},
+    "window world":       {"service": "Windows & Doors"}
+}
+
+# ===================================================================
+# KNOWN MATERIAL, EQUIPMENT & FUEL VENDORS
+# ===================================================================
+MATERIALS_VENDORS = ("home depot", "lowe's", "sherwin-williams")
+RENTAL_VENDORS = ("sunbelt", "united rentals")
+FUEL_VENDORS = ("chevron", "shell", "76")
+
+# ===================================================================
+# CATEGORIZATION RULES, IN PRIORITY ORDER
+# (keywords, category, project) - the first rule with a keyword
+# found anywhere in the name wins.
+# ===================================================================
+CATEGORY_RULES = (
+    # RULE 1: HANDLE TRICKY PAYMENT METHODS FIRST
+    (("quickbooks", "intuit"), "QuickBooks Bill Pay", "NEEDS REVIEW"),
+    (("zelle",), "Zelle Payment", "Bellevue"),
+    (("check #",), "Subcontractor Payout", "Bellevue"),
+    # RULE 2: CHECK THE SUBCONTRACTOR DATABASE
+    *(((sub_keyword,), sub_details["service"], "Bellevue")
+      for sub_keyword, sub_details in SUBCONTRACTOR_DATABASE.items()),
+    # RULE 3: HANDLE KNOWN MATERIAL & EQUIPMENT VENDORS
+    (MATERIALS_VENDORS, "Materials", "Bellevue"),
+    (RENTAL_VENDORS, "Equipment Rental", "Bellevue"),
+    (FUEL_VENDORS, "Fuel", "Admin"),
+)
+
+def _build_category_automaton():
+    """
+    Compile every rule keyword into one Aho-Corasick automaton.
+    Each keyword maps to (priority, category, project), where priority is
+    the rule's position in CATEGORY_RULES (lower number = checked first).
+    """
+    automaton = ahocorasick.Automaton()
+    for priority, (keywords, category, project) in enumerate(CATEGORY_RULES):
+        for keyword in keywords:
+            # Keep the earlier rule if a keyword is listed twice
+            if keyword not in automaton:
+                automaton.add_word(keyword, (priority, category, project))
+    automaton.make_automaton()
+    return automaton
+
+_CATEGORY_AUTOMATON = _build_category_automaton()
+
+# Merchant names repeat a lot (the same store, the same payee), so results
+# are memoized per lowercased name
+@functools.lru_cache(maxsize=4096)
+def categorize_transaction(name_lower):
+    """
+    The "Brain" - Advanced Categorization Function
+    This function contains the specific business logic for the remodeler client.
+    It uses a subcontractor "database" to assign a specific scope of work.
+
+    Takes the transaction name already lowercased ("" if missing), so the
+    caller reads and lowercases it exactly once per transaction, and
+    returns a (category, project) tuple.
+    """
+    # Single linear scan over the name, regardless of how many keywords exist
+    best = None
+    for _, hit in _CATEGORY_AUTOMATON.iter(name_lower):
+        if best is None or hit[0] < best[0]:
+            best = hit
+    if best:
+        return best[1:]
+
+    # ===================================================================
+    # RULE 4: DEFAULT CATCH-ALL
+    # ===================================================================
+    return ("Uncategorized", "Unknown")
@@ -7,9 +7,11 @@ Standalone tool to manage multiple bank accounts
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from plaid import Configuration, ApiClient
 from plaid.api import plaid_api
+from plaid.model.accounts_get_request import AccountsGetRequest
 from bank_accounts import BankAccountManager
 
 # Load environment variables
@@ -20,14 +22,24 @@ PLAID_CLIENT_ID = os.getenv("PLAID_CLIENT_ID")
 PLAID_SECRET = os.getenv("PLAID_SECRET")
 PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
 
+# Upper bound on concurrent Plaid calls when testing connections
+MAX_CONNECTION_TEST_WORKERS = 8
+
 # Configure Plaid client
 plaid_host = "https://sandbox.plaid.com" if PLAID_ENV == "sandbox" else "https://production.plaid.com"
 config = Configuration(
     host=plaid_host,
     api_key={"clientId": PLAID_CLIENT_ID, "secret": PLAID_SECRET}
 )
+# Keep at least one connection per test worker; the default (cpu_count() * 5)
+# is smaller than that on one-CPU machines
+config.connection_pool_maxsize = max(config.connection_pool_maxsize, MAX_CONNECTION_TEST_WORKERS)
 client = plaid_api.PlaidApi(ApiClient(config))
 
+# Public token input: Plaid's prefix and the words that cancel the prompt
+PUBLIC_TOKEN_PREFIX = 'public-'
+CANCEL_INPUTS = frozenset({'cancel', 'quit', 'q', 'exit'})
+
 def show_menu():
     """Show the main menu"""
     print("\n=== Bank Account Management ===")
@@ -53,19 +65,14 @@ def add_account(bank_manager):
         account_name = None
     
     # Get public token from user
-    print("\nTo link a new account:")
-    print("1. Run 'python setup.py' to get a link token")
-    print("2. Use the generated plaid_link.html to connect your bank")
-    print("3. Copy the public token and paste it here")
+    print("\nTo link a new account, run 'python setup.py'; it links the account directly.")
+    print("Only paste a public token here if the Link page displayed one after")
+    print("setup.py stopped waiting for it (public tokens can only be used once).")
     
     while True:
         public_token = input("\nEnter public token (or 'cancel' to exit): ").strip()
         
-        if public_token.lower() == 'cancel':
-            print("Account linking cancelled")
-            return
-        
-        if public_token and public_token.startswith('public-'):
+        if public_token.startswith(PUBLIC_TOKEN_PREFIX):
             print("Exchanging public token for access token...")
             if exchange_public_token(public_token, bank_manager, account_name):
                 print("Bank account added successfully!")
@@ -73,6 +80,9 @@ def add_account(bank_manager):
             else:
                 print("Failed to add bank account. Please try again.")
                 continue
+        elif public_token.lower() in CANCEL_INPUTS:
+            print("Account linking cancelled")
+            return
         else:
             print("Invalid token format. Please enter a valid public token.")
             continue
@@ -94,7 +104,7 @@ def remove_account(bank_manager):
         try:
             choice = input(f"\nEnter account number to remove (1-{len(bank_manager.accounts)}) or 'cancel': ").strip()
             
-            if choice.lower() == 'cancel':
+            if choice.lower() in CANCEL_INPUTS:
                 return
             
             choice_num = int(choice)
@@ -114,6 +124,15 @@ def remove_account(bank_manager):
         except ValueError:
             print("Please enter a valid number")
 
+def _probe_account(account_data):
+    """Call accounts_get for one linked bank; returns (account_name, account_count, error)"""
+    try:
+        accounts_req = AccountsGetRequest(access_token=account_data['access_token'])
+        accounts_resp = client.accounts_get(accounts_req)
+        return account_data['account_name'], len(accounts_resp.accounts), None
+    except Exception as e:
+        return account_data['account_name'], None, e
+
 def test_connection(bank_manager):
     """Test connection to all bank accounts"""
     print("\n=== Testing Bank Account Connections ===")
@@ -122,16 +141,21 @@ def test_connection(bank_manager):
         print("No bank accounts to test")
         return
     
-    for account_id, account_data in bank_manager.accounts.items():
-        print(f"\nTesting {account_data['account_name']}...")
-        
-        try:
-            from plaid.model.accounts_get_request import AccountsGetRequest
-            accounts_req = AccountsGetRequest(access_token=account_data['access_token'])
-            accounts_resp = client.accounts_get(accounts_req)
-            print(f"  ✓ Connection successful - {len(accounts_resp.accounts)} accounts found")
-        except Exception as e:
-            print(f"  ✗ Connection failed: {e}")
+    # Plaid calls are network-bound, so probe all accounts concurrently
+    max_workers = min(len(bank_manager.accounts), MAX_CONNECTION_TEST_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_probe_account, account_data)
+            for account_data in bank_manager.accounts.values()
+        ]
+        for future in as_completed(futures):
+            account_name, account_count, error = future.result()
+            # One write per result instead of a print per line
+            if error is None:
+                status = f"  ✓ Connection successful - {account_count} accounts found"
+            else:
+                status = f"  ✗ Connection failed: {error}"
+            sys.stdout.write(f"\nTesting {account_name}...\n{status}\n")
 
 def migrate_legacy(bank_manager):
     """Migrate legacy access token"""
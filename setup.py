@@ -6,28 +6,34 @@ Configura Plaid y Google Sheets en un solo archivo
 """
 
 import os
-import json
-import datetime
-from dotenv import load_dotenv
-from plaid import Configuration, ApiClient
-from plaid.api import plaid_api
-from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.products import Products
-from plaid.model.country_code import CountryCode
-from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
-
-# Google Sheets imports
-from google.oauth2.credentials import Credentials
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-
-# Bank account management
-from bank_accounts import BankAccountManager
-
-# Load environment variables
-load_dotenv()
+import sys
+import orjson
+import argparse
+import logging
+import secrets
+import functools
+import http.server
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Plaid and Google SDKs, and the bank account manager, are imported inside
+# the functions that use them, so check_environment() and its error paths
+# start without loading them
+
+# Variables setup cannot run without; check_environment reports on these
+REQUIRED_ENV_VARS = ("PLAID_CLIENT_ID", "PLAID_SECRET", "GOOGLE_SHEET_ID")
+
+# Load environment variables from the .env next to this script, unless the
+# environment already provides everything (load_dotenv never overrides it anyway).
+# python-dotenv is only imported when there is something to load.
+if not all(os.environ.get(var) for var in REQUIRED_ENV_VARS + ("PLAID_ENV",)):
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"), override=False)
+
+# Setup messages go through this logger; LOG_LEVEL=WARNING keeps only problems
+log = logging.getLogger("finance_tracker.setup")
 
 # Plaid credentials from environment
 PLAID_CLIENT_ID = os.getenv("PLAID_CLIENT_ID")
@@ -37,54 +43,158 @@ PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
 # Google Sheets configuration
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SPREADSHEET_ID = os.getenv("GOOGLE_SHEET_ID")
+HEADERS_SENTINEL_FILE = '.sheet_headers_ok'
+SHEET_HEADERS = ('transaction_id', 'date', 'name', 'amount', 'category', 'project')
+
+# Every Plaid public token starts with this
+PUBLIC_TOKEN_PREFIX = 'public-'
+
+# How long link_new_account waits for the Link page to post the token back
+LINK_CALLBACK_TIMEOUT = 600
+
+# Plaid Link page served/written by link_new_account
+PLAID_LINK_HTML = string.Template("""
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Plaid Link - Connect Your Bank</title>
+    <script src="https://cdn.plaid.com/link/v2/stable/link-initialize.js"></script>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 40px; }
+        .container { max-width: 600px; margin: 0 auto; }
+        button { background: #007bff; color: white; padding: 15px 30px; border: none; border-radius: 5px; font-size: 16px; cursor: pointer; }
+        button:hover { background: #0056b3; }
+        #result { margin-top: 20px; padding: 15px; background: #f8f9fa; border-radius: 5px; }
+        .success { color: #28a745; }
+        .instructions { background: #e9ecef; padding: 15px; border-radius: 5px; margin: 20px 0; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h2>Connect Your Bank Account</h2>
+        <div class="instructions">
+            <p><strong>Instructions:</strong></p>
+            <p>1. Click "Connect Bank" below</p>
+            <p>2. Select your bank and enter your credentials</p>
+            <p>3. Your account is linked automatically</p>
+            <p>4. Return to the terminal</p>
+        </div>
+        <button id="link-button">Connect Bank</button>
+        <div id="result"></div>
+    </div>
+    
+    <script>
+        document.getElementById('link-button').onclick = function() {
+            const handler = Plaid.create({
+                token: '$link_token',
+                onSuccess: async function(public_token, metadata) {
+                    console.log('Success!', public_token);
+                    document.getElementById('result').innerHTML = '<p>Linking your bank account...</p>';
+                    try {
+                        // Hand the token straight to setup.py, which exchanges it
+                        const resp = await fetch('$callback_url', { method: 'POST', body: public_token });
+                        const data = await resp.json();
+                        document.getElementById('result').innerHTML = data.ok ?
+                            '<div class="success"><h3>[OK] Success!</h3>' +
+                            '<p>Your bank account is linked. You can close this window.</p></div>' :
+                            '<div style="color: #dc3545;"><h3>[ERROR] Linking Failed</h3>' +
+                            '<p>Check the terminal for details and please try again.</p></div>';
+                    } catch (e) {
+                        // setup.py is no longer waiting; show the token for setup.py --exchange-token
+                        document.getElementById('result').innerHTML = 
+                            '<div class="success"><h3>[OK] Success!</h3>' +
+                            '<p><strong>Public Token:</strong></p>' +
+                            '<p style="background: white; padding: 10px; border-radius: 3px; word-break: break-all;">' + public_token + '</p>' +
+                            '<p><strong>Copy this token and run: python setup.py --exchange-token &lt;token&gt;</strong></p></div>';
+                    }
+                },
+                onExit: function(err, metadata) {
+                    console.log('Exit', err, metadata);
+                    if (err) {
+                        document.getElementById('result').innerHTML = 
+                            '<div style="color: #dc3545;"><h3>[ERROR] Connection Failed</h3>' +
+                            '<p>Error: ' + err.error_message + '</p>' +
+                            '<p>Please try again.</p></div>';
+                    }
+                }
+            });
+            handler.open();
+        };
+    </script>
+</body>
+</html>
+""")
 
-# Configure Plaid client
-plaid_host = "https://sandbox.plaid.com" if PLAID_ENV == "sandbox" else "https://production.plaid.com"
-config = Configuration(
-    host=plaid_host,
-    api_key={"clientId": PLAID_CLIENT_ID, "secret": PLAID_SECRET}
-)
-client = plaid_api.PlaidApi(ApiClient(config))
+# Plaid client, configured on first use (see get_plaid_client)
+client = None
+
+def get_plaid_client():
+    """Get the Plaid client, configuring it on first use"""
+    global client
+    if client is None:
+        from plaid import Configuration, ApiClient
+        from plaid.api import plaid_api
+        
+        plaid_host = "https://sandbox.plaid.com" if PLAID_ENV == "sandbox" else "https://production.plaid.com"
+        config = Configuration(
+            host=plaid_host,
+            api_key={"clientId": PLAID_CLIENT_ID, "secret": PLAID_SECRET}
+        )
+        client = plaid_api.PlaidApi(ApiClient(config))
+    return client
+
+@functools.lru_cache(maxsize=1)
+def _get_bank_manager():
+    """Load the bank accounts once per run; the Plaid client is attached when needed"""
+    from bank_accounts import BankAccountManager
+    return BankAccountManager(None)
 
 def check_environment():
     """Check required environment variables"""
-    print("=== Checking Configuration ===")
-    
-    required_vars = {
-        'PLAID_CLIENT_ID': PLAID_CLIENT_ID,
-        'PLAID_SECRET': PLAID_SECRET,
-        'GOOGLE_SHEET_ID': SPREADSHEET_ID
-    }
-    
-    missing_vars = []
-    for var, value in required_vars.items():
-        if not value:
-            missing_vars.append(var)
-        else:
-            print(f"[OK] {var}: {value[:10]}..." if len(str(value)) > 10 else f"[OK] {var}: {value}")
+    log.info("=== Checking Configuration ===")
+    
+    required_vars = {var: os.environ.get(var) for var in REQUIRED_ENV_VARS}
+    
+    # Build the report first and emit it in one call
+    missing_vars = [var for var, value in required_vars.items() if not value]
+    found_lines = [
+        f"[OK] {var}: {value[:10]}..." if len(value) > 10 else f"[OK] {var}: {value}"
+        for var, value in required_vars.items() if value
+    ]
+    if found_lines:
+        log.info("\n".join(found_lines))
     
     if missing_vars:
-        print(f"\n[ERROR] Missing environment variables: {', '.join(missing_vars)}")
-        print("Add these to your .env file:")
-        for var in missing_vars:
-            print(f"{var}=your_value_here")
+        log.error("\n".join(
+            [f"\n[ERROR] Missing environment variables: {', '.join(missing_vars)}",
+             "Add these to your .env file:"] +
+            [f"{var}=your_value_here" for var in missing_vars]
+        ))
         return False
     
-    print("[OK] All environment variables configured")
+    log.info("[OK] All environment variables configured")
     return True
 
 def setup_plaid():
     """Setup Plaid connection"""
-    print("\n=== Setting up Plaid ===")
+    log.info("\n=== Setting up Plaid ===")
     
-    # Initialize bank account manager
-    bank_manager = BankAccountManager(client)
+    # Initialize bank account manager; the Plaid client is attached only
+    # once we actually talk to Plaid (linking or migrating)
+    bank_manager = _get_bank_manager()
     
     # Check if we already have bank accounts
     if bank_manager.accounts:
-        print(f"[OK] Found {len(bank_manager.accounts)} existing bank accounts")
+        log.info(f"[OK] Found {len(bank_manager.accounts)} existing bank accounts")
         bank_manager.list_accounts()
         
+        # Tokens are issued per environment (access-<env>-...), so a switch
+        # between sandbox and production leaves the old ones unusable
+        for account_data in bank_manager.accounts.values():
+            token_env = _token_environment(account_data['access_token'])
+            if token_env and token_env != PLAID_ENV:
+                log.warning(f"[WARNING] '{account_data['account_name']}' was linked in {token_env}, but PLAID_ENV is {PLAID_ENV}")
+        
         # Ask if user wants to add more accounts
         while True:
             add_more = input("\n[INPUT] Do you want to add another bank account? (y/n): ").strip().lower()
@@ -96,301 +206,468 @@ def setup_plaid():
             elif add_more in ['n', 'no']:
                 break
             else:
-                print("[ERROR] Please enter 'y' or 'n'")
+                log.error("[ERROR] Please enter 'y' or 'n'")
         
         return True
     
-    # Check if legacy access token exists
-    if os.path.exists('_access_token.json'):
-        print("[INFO] Found legacy access token. Migrating to new system...")
-        if bank_manager.migrate_legacy_token():
-            print("[OK] Legacy token migrated successfully")
-            return True
+    # Check if legacy access token exists (read once and handed to the migration)
+    try:
+        with open('_access_token.json', 'rb') as f:
+            legacy_data = orjson.loads(f.read())
+    except FileNotFoundError:
+        legacy_data = None
+    except (OSError, ValueError) as e:
+        log.warning(f"[WARNING] Could not read legacy access token: {e}")
+        legacy_data = None
+    
+    if legacy_data:
+        token_env = legacy_data.get('environment') or _token_environment(legacy_data.get('access_token', ''))
+        if token_env and token_env != PLAID_ENV:
+            # Migrating would only fail at Plaid after a wasted round-trip
+            log.warning(f"[WARNING] Legacy access token is for {token_env}, but PLAID_ENV is {PLAID_ENV}. Skipping migration.")
         else:
-            print("[ERROR] Failed to migrate legacy token")
+            log.info("[INFO] Found legacy access token. Migrating to new system...")
+            bank_manager.plaid_client = get_plaid_client()
+            if bank_manager.migrate_legacy_token(legacy_data):
+                log.info("[OK] Legacy token migrated successfully")
+                return True
+            else:
+                log.error("[ERROR] Failed to migrate legacy token")
     
     # No accounts found, need to link first account
-    print("[INFO] No bank accounts found. Let's link your first account...")
+    log.info("[INFO] No bank accounts found. Let's link your first account...")
     return link_new_account(bank_manager)
 
+def _token_environment(access_token):
+    """Plaid environment an access token was issued in (access-<env>-...), or None"""
+    parts = access_token.split('-', 2)
+    if len(parts) == 3 and parts[0] == 'access':
+        return parts[1]
+    return None
+
+def _create_link_token():
+    """Create a Plaid Link token for a new account"""
+    from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+    from plaid.model.link_token_create_request import LinkTokenCreateRequest
+    from plaid.model.products import Products
+    from plaid.model.country_code import CountryCode
+    
+    # Random rather than timestamp-based, so the request doesn't reveal when setup ran
+    user = LinkTokenCreateRequestUser(client_user_id=f"user-{secrets.token_hex(8)}")
+    req = LinkTokenCreateRequest(
+        user=user,
+        client_name="Finance Tracker",
+        products=[Products("transactions")],
+        country_codes=[CountryCode("US")],
+        language="en"
+    )
+    return get_plaid_client().link_token_create(req).link_token
+
+def _launch_browser(html_content, page_url):
+    """Save plaid_link.html and open the Link page (run off the main thread)"""
+    try:
+        with open('plaid_link.html', 'w') as f:
+            f.write(html_content)
+    except OSError as e:
+        log.warning(f"[WARNING] Could not save plaid_link.html: {e}")
+    
+    # Try to open browser automatically
+    try:
+        import webbrowser
+        webbrowser.open(page_url)
+    except:
+        pass
+
 def link_new_account(bank_manager):
     """Link a new bank account"""
-    print("\n=== Linking New Bank Account ===")
+    log.info("\n=== Linking New Bank Account ===")
+    bank_manager.plaid_client = get_plaid_client()
+    
+    # Create the link token while the user is typing the account name
+    executor = ThreadPoolExecutor(max_workers=1)
+    link_token_future = executor.submit(_create_link_token)
+    executor.shutdown(wait=False)
     
     # Get account name from user
     account_name = input("[INPUT] Enter a name for this bank account (or press Enter for auto-generated): ").strip()
     if not account_name:
         account_name = None
     
-    print("Creating link token...")
+    log.info("Creating link token...")
     try:
-        user = LinkTokenCreateRequestUser(client_user_id="user-" + datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
-        req = LinkTokenCreateRequest(
-            user=user,
-            client_name="Finance Tracker",
-            products=[Products("transactions")],
-            country_codes=[CountryCode("US")],
-            language="en"
-        )
-        resp = client.link_token_create(req)
-        link_token = resp.link_token
-        print(f"[OK] Link token created: {link_token[:20]}...")
+        link_token = link_token_future.result()
+        log.info(f"[OK] Link token created: {link_token[:20]}...")
         
-        # Create HTML for connection
-        html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Plaid Link - Connect Your Bank</title>
-    <script src="https://cdn.plaid.com/link/v2/stable/link-initialize.js"></script>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 40px; }}
-        .container {{ max-width: 600px; margin: 0 auto; }}
-        button {{ background: #007bff; color: white; padding: 15px 30px; border: none; border-radius: 5px; font-size: 16px; cursor: pointer; }}
-        button:hover {{ background: #0056b3; }}
-        #result {{ margin-top: 20px; padding: 15px; background: #f8f9fa; border-radius: 5px; }}
-        .success {{ color: #28a745; }}
-        .instructions {{ background: #e9ecef; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h2>Connect Your Bank Account</h2>
-        <div class="instructions">
-            <p><strong>Instructions:</strong></p>
-            <p>1. Click "Connect Bank" below</p>
-            <p>2. Select your bank and enter your credentials</p>
-            <p>3. Copy the public token that appears</p>
-            <p>4. Paste it in the terminal when prompted</p>
-        </div>
-        <button id="link-button">Connect Bank</button>
-        <div id="result"></div>
-    </div>
-    
-    <script>
-        document.getElementById('link-button').onclick = function() {{
-            const handler = Plaid.create({{
-                token: '{link_token}',
-                onSuccess: async function(public_token, metadata) {{
-                    console.log('Success!', public_token);
-                    document.getElementById('result').innerHTML = 
-                        '<div class="success"><h3>[OK] Success!</h3>' +
-                        '<p><strong>Public Token:</strong></p>' +
-                        '<p style="background: white; padding: 10px; border-radius: 3px; word-break: break-all;">' + public_token + '</p>' +
-                        '<p><strong>Copy this token and paste it in the terminal when prompted.</strong></p></div>';
-                }},
-                onExit: function(err, metadata) {{
-                    console.log('Exit', err, metadata);
-                    if (err) {{
-                        document.getElementById('result').innerHTML = 
-                            '<div style="color: #dc3545;"><h3>[ERROR] Connection Failed</h3>' +
-                            '<p>Error: ' + err.error_message + '</p>' +
-                            '<p>Please try again.</p></div>';
-                    }}
-                }}
-            }});
-            handler.open();
-        }};
-    </script>
-</body>
-</html>
-"""
-        with open('plaid_link.html', 'w') as f:
-            f.write(html_content)
+        # Serve the Link page locally; it posts the public token straight back
+        linked = threading.Event()
+        server = _start_link_callback_server(bank_manager, account_name, linked)
+        page_url = f"http://127.0.0.1:{server.server_port}/"
+        callback_url = f"{page_url}exchange"
         
-        print(f"\n[INFO] Opening browser to connect your bank...")
-        print(f"[INFO] If browser doesn't open, manually open: plaid_link.html")
+        # Create HTML for connection; the server has it in memory, so the
+        # file copy and the browser launch happen in the background
+        html_content = PLAID_LINK_HTML.substitute(link_token=link_token, callback_url=callback_url)
+        server.html = html_content
         
-        # Try to open browser automatically
+        log.info(f"\n[INFO] Opening browser to connect your bank...")
+        log.info(f"[INFO] If browser doesn't open, manually open: {page_url}")
+        threading.Thread(target=_launch_browser, args=(html_content, page_url), daemon=True).start()
+        
+        # Wait for the page to post the public token back
+        log.info(f"\n[WAIT] Waiting for you to connect your bank... (Ctrl+C to cancel)")
+        deadline = time.monotonic() + LINK_CALLBACK_TIMEOUT
         try:
-            import webbrowser
-            webbrowser.open('plaid_link.html')
-        except:
-            pass
+            # Short waits keep Ctrl+C responsive on every platform
+            while not linked.wait(0.5):
+                if time.monotonic() > deadline:
+                    log.error(f"[ERROR] No bank connected after {LINK_CALLBACK_TIMEOUT // 60} minutes")
+                    log.error("If the page shows a public token, run: python setup.py --exchange-token <token>")
+                    return False
+        except KeyboardInterrupt:
+            log.error("\n[ERROR] Account linking cancelled")
+            return False
+        finally:
+            server.shutdown()
+            server.server_close()
         
-        # Wait for user to provide public token
-        print(f"\n[WAIT] Waiting for you to connect your bank...")
-        print(f"[INFO] After connecting, copy the public token and paste it here:")
+        log.info(f"[OK] Bank account linked successfully!")
+        return True
         
-        while True:
-            public_token = input("\n[INPUT] Enter public token (or 'quit' to exit): ").strip()
+    except Exception as e:
+        log.error(f"[ERROR] Error creating link token: {e}")
+        return False
+
+def _start_link_callback_server(bank_manager, account_name, linked):
+    """Serve the Plaid Link page on localhost and exchange the public token it posts back"""
+    exchange_lock = threading.Lock()
+    
+    class LinkCallbackHandler(http.server.BaseHTTPRequestHandler):
+        def _send(self, status, content_type, body, allow_file_origin=False):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if allow_file_origin:
+                # plaid_link.html opened straight from disk posts from the
+                # 'null' origin; no other page may read the exchange result
+                self.send_header('Access-Control-Allow-Origin', 'null')
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def do_GET(self):
+            self._send(200, 'text/html; charset=utf-8', self.server.html.encode('utf-8'))
+        
+        def do_POST(self):
+            if self.path != '/exchange':
+                self._send(404, 'text/plain', b'Not found')
+                return
             
-            if public_token.lower() == 'quit':
-                print("[ERROR] Account linking cancelled")
-                return False
+            length = int(self.headers.get('Content-Length', 0))
+            public_token = self.rfile.read(length).decode('utf-8').strip()
             
-            if public_token and public_token.startswith('public-'):
-                print(f"[PROCESS] Exchanging public token for access token...")
-                if exchange_public_token(public_token, bank_manager, account_name):
-                    print(f"[OK] Bank account linked successfully!")
-                    return True
+            ok = False
+            with exchange_lock:
+                if linked.is_set():
+                    ok = True
+                elif public_token.startswith(PUBLIC_TOKEN_PREFIX):
+                    log.info(f"[PROCESS] Exchanging public token for access token...")
+                    ok = exchange_public_token(public_token, bank_manager, account_name)
+                    if ok:
+                        linked.set()
                 else:
-                    print(f"[ERROR] Failed to exchange token. Please try again.")
-                    continue
-            else:
-                print(f"[ERROR] Invalid token format. Please enter a valid public token.")
-                continue
+                    log.error(f"[ERROR] Invalid token format received from the browser")
+            
+            self._send(200, 'application/json', orjson.dumps({'ok': ok}), allow_file_origin=True)
         
-    except Exception as e:
-        print(f"[ERROR] Error creating link token: {e}")
-        return False
+        def log_message(self, format, *args):
+            # Keep request logging out of the setup output
+            pass
+    
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), LinkCallbackHandler)
+    server.html = ''
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
 
 def exchange_public_token(public_token, bank_manager, account_name=None):
     """Exchange public token for access token and add to bank manager"""
-    print(f"\n=== Exchanging public token ===")
+    log.info(f"\n=== Exchanging public token ===")
     
     try:
-        ex = client.item_public_token_exchange(ItemPublicTokenExchangeRequest(public_token=public_token))
+        from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
+        
+        ex = get_plaid_client().item_public_token_exchange(ItemPublicTokenExchangeRequest(public_token=public_token))
         access_token = ex.access_token
         
         # Add account to bank manager
         if bank_manager.add_account(access_token, account_name):
-            print(f"[OK] Bank account added successfully")
+            log.info(f"[OK] Bank account added successfully")
             return True
         else:
-            print(f"[ERROR] Failed to add bank account")
+            log.error(f"[ERROR] Failed to add bank account")
             return False
         
     except Exception as e:
-        print(f"[ERROR] Error exchanging token: {e}")
+        log.error(f"[ERROR] Error exchanging token: {e}")
         return False
 
+@functools.lru_cache(maxsize=1)
+def _load_creds_data():
+    """Parse credentials.json once per run"""
+    with open('credentials.json', 'rb') as f:
+        return orjson.loads(f.read())
+
+@functools.lru_cache(maxsize=1)
+def _get_google_creds():
+    """Get Google credentials (Service Account or OAuth) once per run"""
+    creds_data = _load_creds_data()
+    
+    if 'type' in creds_data and creds_data['type'] == 'service_account':
+        # Service Account, built from the already-parsed file
+        from google.oauth2 import service_account
+        return service_account.Credentials.from_service_account_info(creds_data, scopes=SCOPES)
+    
+    # OAuth
+    if os.path.exists('token.json'):
+        from google.oauth2.credentials import Credentials
+        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        if creds.expired and creds.refresh_token:
+            # Save the refreshed token so later runs within the hour skip the refresh call
+            from google.auth.transport.requests import Request
+            creds.refresh(Request())
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+        return creds
+    
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    flow = InstalledAppFlow.from_client_config(creds_data, SCOPES)
+    creds = flow.run_local_server(port=0)
+    
+    # Save token for future use
+    with open('token.json', 'w') as token:
+        token.write(creds.to_json())
+    return creds
+
+@functools.lru_cache(maxsize=1)
+def _get_sheets_service():
+    """Build the Google Sheets service once per run"""
+    from googleapiclient.discovery import build
+    # The Sheets discovery document ships with google-api-python-client, so
+    # read it from the package instead of fetching or caching it
+    return build('sheets', 'v4', credentials=_get_google_creds(),
+                 static_discovery=True, cache_discovery=False)
+
+def _prewarm_sheets_service():
+    """Build the Sheets service in the background when that needs no user interaction"""
+    try:
+        creds_data = _load_creds_data()
+        # A first-time OAuth login opens the browser, so it waits for setup_google_sheets
+        if creds_data.get('type') == 'service_account' or os.path.exists('token.json'):
+            _get_sheets_service()
+    except Exception:
+        # setup_google_sheets reports any problem, in order, when it runs
+        pass
+
 def setup_google_sheets():
     """Setup Google Sheets"""
-    print("\n=== Setting up Google Sheets ===")
-    
-    # Check if credentials.json exists
-    if not os.path.exists('credentials.json'):
-        print("[ERROR] credentials.json not found!")
-        print("\nTo setup Google Sheets API:")
-        print("1. Go to https://console.cloud.google.com/")
-        print("2. Create a new project or select existing one")
-        print("3. Enable Google Sheets API")
-        print("4. Go to 'Credentials' -> 'Create Credentials' -> 'Service Account'")
-        print("5. Download the JSON file and save as 'credentials.json'")
-        print("6. Share your Google Sheet with the service account email")
+    log.info("\n=== Setting up Google Sheets ===")
+    
+    # Parse credentials.json (usually already cached by the prewarm), so
+    # no separate existence check is needed
+    try:
+        creds_data = _load_creds_data()
+    except FileNotFoundError:
+        log.error("[ERROR] credentials.json not found!")
+        log.error("\nTo setup Google Sheets API:")
+        log.error("1. Go to https://console.cloud.google.com/")
+        log.error("2. Create a new project or select existing one")
+        log.error("3. Enable Google Sheets API")
+        log.error("4. Go to 'Credentials' -> 'Create Credentials' -> 'Service Account'")
+        log.error("5. Download the JSON file and save as 'credentials.json'")
+        log.error("6. Share your Google Sheet with the service account email")
+        return False
+    except Exception as e:
+        log.error(f"[ERROR] Error reading credentials.json: {e}")
         return False
     
-    print("[OK] credentials.json found")
+    log.info("[OK] credentials.json found")
     
     # Check if it's Service Account or OAuth
     try:
-        with open('credentials.json', 'r') as f:
-            creds_data = json.load(f)
-        
         if 'type' in creds_data and creds_data['type'] == 'service_account':
-            print("[OK] Service Account detected - no additional authentication required")
+            log.info("[OK] Service Account detected - no additional authentication required")
             return True
         else:
             # It's OAuth credentials, check if token.json exists
             if os.path.exists('token.json'):
-                print("[OK] Google Sheets token already exists")
+                log.info("[OK] Google Sheets token already exists")
                 return True
             
-            # Authenticate with Google OAuth
-            print("Authenticating with Google OAuth...")
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-            
-            # Save token for future use
-            with open('token.json', 'w') as token:
-                token.write(creds.to_json())
+            # Authenticate with Google OAuth (the credentials are cached for setup_sheet_headers)
+            log.info("Authenticating with Google OAuth...")
+            _get_google_creds()
             
-            print("[OK] Google authentication completed")
+            log.info("[OK] Google authentication completed")
             return True
         
     except Exception as e:
-        print(f"[ERROR] Error authenticating with Google: {e}")
+        log.error(f"[ERROR] Error authenticating with Google: {e}")
         return False
 
+def _load_headers_sentinel():
+    """Sheet names whose headers were already written for this spreadsheet"""
+    try:
+        with open(HEADERS_SENTINEL_FILE, 'rb') as f:
+            sentinel = orjson.loads(f.read())
+        # A different spreadsheet or a changed header row means starting over
+        if (sentinel.get('spreadsheet_id') == SPREADSHEET_ID and
+                tuple(sentinel.get('headers', ())) == SHEET_HEADERS):
+            return set(sentinel.get('sheets', []))
+    except (OSError, ValueError):
+        pass
+    return set()
+
+def _save_headers_sentinel(sheet_names):
+    """Remember which sheets have headers so later runs can skip them"""
+    tmp_file = HEADERS_SENTINEL_FILE + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(
+                {'spreadsheet_id': SPREADSHEET_ID, 'headers': SHEET_HEADERS, 'sheets': sorted(sheet_names)},
+                option=orjson.OPT_INDENT_2
+            ))
+        os.replace(tmp_file, HEADERS_SENTINEL_FILE)
+    except OSError as e:
+        log.warning(f"[WARNING] Could not save {HEADERS_SENTINEL_FILE}: {e}")
+
+def _sheet_headers_pending():
+    """Whether setup_sheet_headers may need the Sheets API this run"""
+    accounts = _get_bank_manager().accounts
+    if not accounts:
+        # setup_plaid is about to link the first account
+        return True
+    done_sheets = _load_headers_sentinel()
+    return any(
+        account_data.get('sheet_name', account_data['account_name']) not in done_sheets
+        for account_data in accounts.values()
+    )
+
 def setup_sheet_headers():
     """Setup headers in Google Sheet for each bank account"""
-    print("\n=== Setting up Google Sheet headers ===")
+    log.info("\n=== Setting up Google Sheet headers ===")
     
     try:
-        # Authenticate based on credential type
-        with open('credentials.json', 'r') as f:
-            creds_data = json.load(f)
-        
-        if 'type' in creds_data and creds_data['type'] == 'service_account':
-            # Service Account
-            creds = service_account.Credentials.from_service_account_file(
-                'credentials.json', 
-                scopes=SCOPES
-            )
-        else:
-            # OAuth
-            if os.path.exists('token.json'):
-                creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-        
-        service = build('sheets', 'v4', credentials=creds)
-        
-        # Initialize bank account manager to get account info
-        bank_manager = BankAccountManager(client)
+        # Same accounts setup_plaid loaded and linked (read-only, no Plaid calls)
+        bank_manager = _get_bank_manager()
         
         if not bank_manager.accounts:
-            print("[INFO] No bank accounts found. Headers will be set up when accounts are linked.")
+            log.info("[INFO] No bank accounts found. Headers will be set up when accounts are linked.")
             return True
         
-        # Set up headers for each bank account sheet
+        # Sheets whose headers an earlier run already wrote are skipped
+        done_sheets = _load_headers_sentinel()
+        pending_sheets = []
         for account_id, account_data in bank_manager.accounts.items():
             sheet_name = account_data.get('sheet_name', account_data['account_name'])
-            print(f"Setting up headers for sheet: {sheet_name}")
+            if sheet_name in done_sheets:
+                log.info(f"[OK] Headers already exist for sheet '{sheet_name}'")
+            else:
+                log.info(f"Setting up headers for sheet: {sheet_name}")
+                pending_sheets.append(sheet_name)
+        
+        if pending_sheets:
+            # Reuses the credentials and service from setup_google_sheets; a
+            # run with nothing pending never touches the Sheets API
+            service = _get_sheets_service()
+            
+            # One metadata call with just the titles tells us which sheets exist;
+            # a write to a missing sheet would fail the whole batch
+            spreadsheet = service.spreadsheets().get(
+                spreadsheetId=SPREADSHEET_ID,
+                fields='sheets.properties.title'
+            ).execute()
+            existing_titles = {sheet['properties']['title'] for sheet in spreadsheet.get('sheets', [])}
+            
+            written_sheets = [sheet_name for sheet_name in pending_sheets if sheet_name in existing_titles]
+            for sheet_name in pending_sheets:
+                if sheet_name not in existing_titles:
+                    log.info(f"[INFO] Sheet '{sheet_name}' doesn't exist yet; sync.py will create it with headers")
             
-            try:
-                # Check if headers already exist
-                range_name = f"{sheet_name}!A1:F1"
-                result = service.spreadsheets().values().get(
-                    spreadsheetId=SPREADSHEET_ID, 
-                    range=range_name
+            if written_sheets:
+                # Writing the fixed header row is idempotent, so skip reading
+                # row 1 and write every existing sheet in one round-trip
+                header_row = [list(SHEET_HEADERS)]
+                service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=SPREADSHEET_ID,
+                    body={
+                        'valueInputOption': 'RAW',
+                        'data': [
+                            {'range': f"{sheet_name}!A1:F1", 'values': header_row}
+                            for sheet_name in written_sheets
+                        ]
+                    }
                 ).execute()
                 
-                values = result.get('values', [])
-                
-                # If no headers or wrong headers, set them up
-                expected_headers = ['transaction_id', 'date', 'name', 'amount', 'category', 'project']
-                if not values or values[0] != expected_headers:
-                    headers = [expected_headers]
-                    
-                    body = {'values': headers}
-                    
-                    service.spreadsheets().values().update(
-                        spreadsheetId=SPREADSHEET_ID,
-                        range=f"{sheet_name}!A1:F1",
-                        valueInputOption='RAW',
-                        body=body
-                    ).execute()
-                    
-                    print(f"[OK] Headers set up for sheet '{sheet_name}'")
-                else:
-                    print(f"[OK] Headers already exist for sheet '{sheet_name}'")
-                    
-            except Exception as e:
-                print(f"[WARNING] Could not set up headers for '{sheet_name}': {e}")
-                continue
+                for sheet_name in written_sheets:
+                    log.info(f"[OK] Headers set up for sheet '{sheet_name}'")
+                _save_headers_sentinel(done_sheets | set(written_sheets))
         
-        print("[OK] Google Sheet headers setup completed")
+        log.info("[OK] Google Sheet headers setup completed")
         return True
         
     except Exception as e:
-        print(f"[ERROR] Error setting up headers: {e}")
+        log.error(f"[ERROR] Error setting up headers: {e}")
         return False
 
+def parse_args():
+    """Parse command-line options"""
+    parser = argparse.ArgumentParser(description="Finance Tracker setup")
+    parser.add_argument('--exchange-token', metavar='PUBLIC_TOKEN',
+                        help="link an account from a Plaid public token instead of opening Plaid Link")
+    parser.add_argument('--name', help="account name to use with --exchange-token")
+    return parser.parse_args()
+
 def main():
-    print("=== Finance Tracker Setup ===")
+    args = parse_args()
+    level_name = (os.environ.get("LOG_LEVEL") or "INFO").upper()
+    level = logging.getLevelName(level_name)
+    logging.basicConfig(
+        level=level if isinstance(level, int) else logging.INFO,
+        format="%(message)s",
+        stream=sys.stdout
+    )
+    if not isinstance(level, int):
+        log.warning(f"[WARNING] Unknown LOG_LEVEL '{level_name}', using INFO")
+    log.info("=== Finance Tracker Setup ===")
     
     # Check environment
     if not check_environment():
         return
     
+    # Public token copied from the Link page: just exchange it
+    if args.exchange_token:
+        if not args.exchange_token.startswith(PUBLIC_TOKEN_PREFIX):
+            log.error(f"[ERROR] Invalid token format. Public tokens start with '{PUBLIC_TOKEN_PREFIX}'")
+            return
+        bank_manager = _get_bank_manager()
+        bank_manager.plaid_client = get_plaid_client()
+        if exchange_public_token(args.exchange_token, bank_manager, args.name):
+            log.info("You can now run: python setup.py")
+        return
+    
+    # Build the Sheets service while the user works through the Plaid prompts,
+    # unless every sheet already has its headers and no Sheets call is due
+    sheets_prewarm = None
+    if _sheet_headers_pending():
+        executor = ThreadPoolExecutor(max_workers=1)
+        sheets_prewarm = executor.submit(_prewarm_sheets_service)
+        executor.shutdown(wait=False)
+    
     # Setup Plaid
     if not setup_plaid():
         return
     
-    # Setup Google Sheets
+    # Setup Google Sheets (the cached credentials and service are ready by now)
+    if sheets_prewarm is not None:
+        sheets_prewarm.result()
     if not setup_google_sheets():
         return
     
@@ -398,8 +675,8 @@ def main():
     if not setup_sheet_headers():
         return
     
-    print("\n[SUCCESS] Setup completed!")
-    print("You can now run: python sync.py")
+    log.info("\n[SUCCESS] Setup completed!")
+    log.info("You can now run: python sync.py")
 
 if __name__ == "__main__":
     main()
@@ -5,23 +5,23 @@ Finance Tracker Sync - Versión Simplificada
 Solo sincroniza transacciones de Plaid a Google Sheets
 """
 
-import json
+import orjson
 import datetime
+import functools
+import itertools
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+import diskcache
 from dotenv import load_dotenv
-from plaid import Configuration, ApiClient
-from plaid.api import plaid_api
-from plaid.model.transactions_get_request import TransactionsGetRequest
 
-# Google Sheets imports
-from google.oauth2.credentials import Credentials
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
+# Plaid and Google SDKs are imported inside the functions that use them,
+# so a misconfigured run exits before paying for those imports
 
 # Bank account management
 from bank_accounts import BankAccountManager
+from transaction_index import TransactionIndex
+from categorization import categorize_transaction
 
 # Load environment variables
 load_dotenv()
@@ -35,18 +35,42 @@ PLAID_ENV = os.getenv("PLAID_ENV", "sandbox")
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 SPREADSHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 SHEET_NAME = "All_Transactions"
+SHEET_HEADERS = ('transaction_id', 'date', 'name', 'amount', 'category', 'project')
+APPEND_BATCH_SIZE = 500  # rows per values.append request
+MAX_FETCH_WORKERS = 10  # concurrent Plaid transaction fetches
+SYNC_PAGE_SIZE = 500  # transactions per /transactions/sync page (Plaid's max)
+INITIAL_SYNC_DAYS = 60  # history to import on an account's first sync
+EXISTING_IDS_TAIL_ROWS = 5000  # trailing sheet rows checked for IDs the index hasn't seen
 
-# Configure Plaid client
-plaid_host = "https://sandbox.plaid.com" if PLAID_ENV == "sandbox" else "https://production.plaid.com"
-config = Configuration(
-    host=plaid_host,
-    api_key={"clientId": PLAID_CLIENT_ID, "secret": PLAID_SECRET}
-)
-client = plaid_api.PlaidApi(ApiClient(config))
+# On-disk cache for Sheets metadata (sheet titles rarely change between runs)
+SHEETS_CACHE_DIR = '.sheets_cache'
+SHEET_TITLES_TTL = 60  # seconds
+
+# Plaid client, configured on first use (see get_plaid_client)
+client = None
+
+def get_plaid_client():
+    """Get the Plaid client, configuring it on first use"""
+    global client
+    if client is None:
+        from plaid import Configuration, ApiClient
+        from plaid.api import plaid_api
+        
+        plaid_host = "https://sandbox.plaid.com" if PLAID_ENV == "sandbox" else "https://production.plaid.com"
+        config = Configuration(
+            host=plaid_host,
+            api_key={"clientId": PLAID_CLIENT_ID, "secret": PLAID_SECRET}
+        )
+        # Keep at least one kept-alive connection per fetch worker; the default
+        # (cpu_count() * 5) is smaller than that on one-CPU machines, which would
+        # drop the extra connections and redo their TLS handshakes
+        config.connection_pool_maxsize = max(config.connection_pool_maxsize, MAX_FETCH_WORKERS)
+        client = plaid_api.PlaidApi(ApiClient(config))
+    return client
 
 def load_bank_accounts():
     """Load bank account manager and migrate legacy token if needed"""
-    bank_manager = BankAccountManager(client)
+    bank_manager = BankAccountManager(get_plaid_client())
     
     # Try to migrate legacy token if no accounts exist
     if not bank_manager.accounts:
@@ -59,175 +83,238 @@ def load_bank_accounts():
     
     return bank_manager
 
+@functools.lru_cache(maxsize=1)
+def _build_sheets_service():
+    """Parse credentials.json and build the Sheets service once per process"""
+    from google.oauth2.credentials import Credentials
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    
+    # Check credential type
+    with open('credentials.json', 'rb') as f:
+        creds_data = orjson.loads(f.read())
+    
+    if 'type' in creds_data and creds_data['type'] == 'service_account':
+        # Service Account, built from the already-parsed file
+        creds = service_account.Credentials.from_service_account_info(
+            creds_data, 
+            scopes=SCOPES
+        )
+    else:
+        # OAuth
+        if os.path.exists('token.json'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+            if creds.expired and creds.refresh_token:
+                # Save the refreshed token so later runs within the hour skip the refresh call
+                from google.auth.transport.requests import Request
+                creds.refresh(Request())
+                with open('token.json', 'w') as token:
+                    token.write(creds.to_json())
+        else:
+            # If no token, do authentication flow
+            flow = InstalledAppFlow.from_client_config(creds_data, SCOPES)
+            creds = flow.run_local_server(port=0)
+            
+            # Save token for future use
+            with open('token.json', 'w') as token:
+                token.write(creds.to_json())
+    
+    # The Sheets discovery document ships with google-api-python-client, so
+    # read it from the package instead of fetching or caching it
+    return build('sheets', 'v4', credentials=creds,
+                 static_discovery=True, cache_discovery=False)
+
 def get_google_sheets_service():
     """Get Google Sheets service"""
     try:
-        # Check credential type
-        with open('credentials.json', 'r') as f:
-            creds_data = json.load(f)
-        
-        if 'type' in creds_data and creds_data['type'] == 'service_account':
-            # Service Account
-            creds = service_account.Credentials.from_service_account_file(
-                'credentials.json', 
-                scopes=SCOPES
-            )
-        else:
-            # OAuth
-            if os.path.exists('token.json'):
-                creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-            else:
-                # If no token, do authentication flow
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-                
-                # Save token for future use
-                with open('token.json', 'w') as token:
-                    token.write(creds.to_json())
-        
-        service = build('sheets', 'v4', credentials=creds)
-        return service
-        
+        return _build_sheets_service()
     except Exception as e:
+        # Failures aren't cached, so a later call tries again
         print(f"[ERROR] Error authenticating with Google Sheets: {e}")
         return None
 
-def categorize_transaction(txn):
-    """
-    The "Brain" - Advanced Categorization Function
-    This function contains the specific business logic for the remodeler client.
-    It uses a subcontractor "database" to assign a specific scope of work.
-    """
-    # Use .lower() and handle cases where the name might be missing
-    name = txn.name.lower() if txn.name else ""
-
-    # ===================================================================
-    # STEP 1: THE SUBCONTRACTOR DATABASE
-    # Maps a keyword from the sub's name to their specific service.
-    # This is our source of truth.
-    # ===================================================================
-    SUBCONTRACTOR_DATABASE = {
-        "all-pro plumbing":   {"service": "Plumbing"},
-        "j&l electric":       {"service": "Electrical"},
-        "sal's drywall":      {"service": "Drywall & Paint"},
-        "creative landscape": {"service": "Landscaping"},
-        "best quality roofing": {"service": "Roofing"},
-        "a-1 painting":       {"service": "Drywall & Paint"},
-        "precision framing":  {"service": "Framing"},
-        "elite concrete":     {"service": "Concrete & Foundation"},
-        "custom cabinetry":  {"service": "Cabinets & Millwork"},
-        "total home insulation": {"service": "Insulation"},
-        "flores tile & stone": {"service": "Flooring & Tile"},
-        "window world":       {"service": "Windows & Doors"}
-    }
-
-    # ===================================================================
-    # RULE 1: HANDLE TRICKY PAYMENT METHODS FIRST
-    # ===================================================================
-    if "quickbooks" in name or "intuit" in name:
-        return {"category": "QuickBooks Bill Pay", "project": "NEEDS REVIEW"}
-    if "zelle" in name:
-        return {"category": "Zelle Payment", "project": "Bellevue"}
-    if "check #" in name:
-        return {"category": "Subcontractor Payout", "project": "Bellevue"}
-
-    # ===================================================================
-    # RULE 2: CHECK THE SUBCONTRACTOR DATABASE (THE NEW, SMART RULE)
-    # ===================================================================
-    for sub_keyword, sub_details in SUBCONTRACTOR_DATABASE.items():
-        if sub_keyword in name:
-            # We found a match! Use the specific service as the category.
-            return {"category": sub_details["service"], "project": "Bellevue"}
-
-    # ===================================================================
-    # RULE 3: HANDLE KNOWN MATERIAL & EQUIPMENT VENDORS
-    # ===================================================================
-    if any(vendor in name for vendor in ["home depot", "lowe's", "sherwin-williams"]):
-        return {"category": "Materials", "project": "Bellevue"}
-    if any(vendor in name for vendor in ["sunbelt", "united rentals"]):
-        return {"category": "Equipment Rental", "project": "Bellevue"}
-    if any(vendor in name for vendor in ["chevron", "shell", "76"]):
-        return {"category": "Fuel", "project": "Admin"}
-
-    # ===================================================================
-    # RULE 4: DEFAULT CATCH-ALL
-    # ===================================================================
-    else:
-        return {"category": "Uncategorized", "project": "Unknown"}
-
-def get_existing_transaction_ids(service, sheet_name):
-    """Get existing transaction IDs from a specific Google Sheet"""
+def get_existing_transaction_ids(service, sheet_name, start_row=1):
+    """Get existing transaction IDs from a specific Google Sheet, from start_row down"""
     try:
-        range_name = f"{sheet_name}!A:A"  # Column A contains transaction IDs
+        range_name = f"{sheet_name}!A{start_row}:A"  # Column A contains transaction IDs
+        # Ask for the column as one flat list, without server-side formatting
         result = service.spreadsheets().values().get(
             spreadsheetId=SPREADSHEET_ID, 
-            range=range_name
+            range=range_name,
+            majorDimension='COLUMNS',
+            valueRenderOption='UNFORMATTED_VALUE'
         ).execute()
         
-        values = result.get('values', [])
-        # Skip header and return set of transaction IDs
-        return set(row[0] for row in values[1:] if row)
+        columns = result.get('values')
+        if not columns:
+            return set()
+        # Skip header (when the range includes it) and return set of transaction IDs
+        return set(columns[0][1:] if start_row == 1 else columns[0])
     except Exception as e:
         print(f"[WARNING] Could not fetch existing transactions from {sheet_name}: {e}")
         return set()
 
-def create_sheet_if_not_exists(service, sheet_name):
-    """Create a new sheet if it doesn't exist"""
+@functools.lru_cache(maxsize=1)
+def _get_sheets_cache():
+    """Open the Sheets metadata cache on first use, so importing sync creates nothing"""
+    return diskcache.Cache(SHEETS_CACHE_DIR)
+
+def get_sheet_titles(service):
+    """Get the titles of all sheets, cached on disk with a stale fallback"""
+    key = ('sheet_titles', SPREADSHEET_ID)
+    stale_key = key + ('stale',)
+    sheets_cache = _get_sheets_cache()
+    
+    titles = sheets_cache.get(key)
+    if titles is not None:
+        return titles
+    
+    from googleapiclient.errors import HttpError
+    try:
+        spreadsheet = service.spreadsheets().get(
+            spreadsheetId=SPREADSHEET_ID,
+            fields='sheets.properties.title'
+        ).execute()
+    except HttpError as e:
+        # Sheets API is down or rate limited; fall back to the last known list
+        titles = sheets_cache.get(stale_key)
+        if titles is None:
+            raise
+        print(f"[WARNING] Using cached sheet list, Sheets API unavailable: {e}")
+        return titles
+    
+    titles = [sheet['properties']['title'] for sheet in spreadsheet['sheets']]
+    sheets_cache.set(key, titles, expire=SHEET_TITLES_TTL)
+    sheets_cache.set(stale_key, titles)
+    return titles
+
+def _remember_sheet_titles(sheet_names):
+    """Add newly created sheets to the cached sheet list"""
+    key = ('sheet_titles', SPREADSHEET_ID)
+    sheets_cache = _get_sheets_cache()
+    for cache_key, expire in ((key, SHEET_TITLES_TTL), (key + ('stale',), None)):
+        titles = sheets_cache.get(cache_key)
+        if titles is not None:
+            new_titles = [name for name in sheet_names if name not in titles]
+            if new_titles:
+                sheets_cache.set(cache_key, titles + new_titles, expire=expire)
+
+def create_missing_sheets(service, sheet_names):
+    """Create the sheets that don't exist yet, with headers; returns the names created"""
     try:
         # Get all sheets
-        spreadsheet = service.spreadsheets().get(spreadsheetId=SPREADSHEET_ID).execute()
-        existing_sheets = [sheet['properties']['title'] for sheet in spreadsheet['sheets']]
+        existing_sheets = set(get_sheet_titles(service))
         
-        if sheet_name not in existing_sheets:
-            print(f"Creating new sheet: {sheet_name}")
-            
-            # Create new sheet
-            request_body = {
-                'requests': [{
-                    'addSheet': {
-                        'properties': {
-                            'title': sheet_name
-                        }
-                    }
-                }]
+        missing_sheets = []
+        for sheet_name in sheet_names:
+            if sheet_name in existing_sheets:
+                print(f"[OK] Sheet '{sheet_name}' already exists")
+            elif sheet_name not in missing_sheets:
+                print(f"Creating new sheet: {sheet_name}")
+                missing_sheets.append(sheet_name)
+        
+        if not missing_sheets:
+            return set()
+        
+        # Create every new sheet in one request
+        service.spreadsheets().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={
+                'requests': [
+                    {'addSheet': {'properties': {'title': sheet_name}}}
+                    for sheet_name in missing_sheets
+                ]
             }
-            
-            service.spreadsheets().batchUpdate(
-                spreadsheetId=SPREADSHEET_ID,
-                body=request_body
-            ).execute()
-            
-            # Set up headers
-            headers = [['transaction_id', 'date', 'name', 'amount', 'category', 'project']]
-            body = {'values': headers}
-            
-            service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=f"{sheet_name}!A1:F1",
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
+        ).execute()
+        
+        # Set up all their headers in one more
+        header_row = [list(SHEET_HEADERS)]
+        service.spreadsheets().values().batchUpdate(
+            spreadsheetId=SPREADSHEET_ID,
+            body={
+                'valueInputOption': 'RAW',
+                'data': [
+                    {'range': f"{sheet_name}!A1:F1", 'values': header_row}
+                    for sheet_name in missing_sheets
+                ]
+            }
+        ).execute()
+        
+        _remember_sheet_titles(missing_sheets)
+        for sheet_name in missing_sheets:
             print(f"[OK] Created sheet '{sheet_name}' with headers")
-        else:
-            print(f"[OK] Sheet '{sheet_name}' already exists")
+        return set(missing_sheets)
             
     except Exception as e:
-        print(f"[ERROR] Error creating sheet '{sheet_name}': {e}")
+        print(f"[ERROR] Error creating sheets: {e}")
+        return set()
+
+def get_all_existing_transaction_ids(service, sheet_names):
+    """Get existing transaction IDs for several sheets in one batchGet, keyed by sheet name"""
+    if not sheet_names:
+        return {}
+    try:
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=SPREADSHEET_ID,
+            ranges=[f"{sheet_name}!A:A" for sheet_name in sheet_names],
+            majorDimension='COLUMNS',
+            valueRenderOption='UNFORMATTED_VALUE'
+        ).execute()
+        
+        # valueRanges come back in the order the ranges were requested;
+        # skip each header and keep the set of transaction IDs
+        return {
+            sheet_name: set(value_range['values'][0][1:]) if value_range.get('values') else set()
+            for sheet_name, value_range in zip(sheet_names, result.get('valueRanges', []))
+        }
+    except Exception as e:
+        print(f"[WARNING] Could not fetch existing transactions in one request: {e}")
+        return {}
+
+def fetch_transactions_page(access_token, cursor):
+    """Fetch one page of transaction updates from Plaid's /transactions/sync"""
+    kwargs = {'count': SYNC_PAGE_SIZE}
+    if cursor:
+        kwargs['cursor'] = cursor
+    from plaid.model.transactions_sync_request import TransactionsSyncRequest
+    return get_plaid_client().transactions_sync(TransactionsSyncRequest(access_token=access_token, **kwargs))
 
-def get_all_existing_transaction_ids(service, bank_manager):
-    """Get all existing transaction IDs from all bank sheets"""
-    all_ids = set()
-    for account_id, account_data in bank_manager.accounts.items():
-        sheet_name = account_data.get('sheet_name', account_data['account_name'])
-        sheet_ids = get_existing_transaction_ids(service, sheet_name)
-        all_ids.update(sheet_ids)
-    return all_ids
+def iter_sync_pages(first_page, access_token):
+    """Yield /transactions/sync pages one at a time, starting from an already-fetched page"""
+    page = first_page
+    yield page
+    while page.has_more:
+        page = fetch_transactions_page(access_token, page.next_cursor)
+        yield page
+
+def build_new_transaction_rows(transactions, existing_ids):
+    """Yield categorized sheet rows for transactions not already in the sheet"""
+    # Plaid model attributes are resolved through __getattr__, so each one is
+    # read once; the date formatter is bound locally for the same reason
+    to_iso = datetime.date.isoformat
+    for t in transactions:
+        transaction_id = t.transaction_id
+        if transaction_id not in existing_ids:
+            # Read the name once and lowercase it once
+            name = t.name
+            category, project = categorize_transaction(name.lower() if name else "")
+            # Row format: [transaction_id, date, name, amount, category, project]
+            yield [transaction_id, to_iso(t.date), name, t.amount, category, project]
+
+def iter_batches(rows, size=APPEND_BATCH_SIZE):
+    """Group an iterable of rows into lists of at most `size` rows"""
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
 
 def append_transactions_to_sheet(service, transactions_data, sheet_name):
     """Append new transactions to a specific Google Sheet"""
     if not transactions_data:
-        return
+        return True
     
     try:
         range_name = f"{sheet_name}!A:F"  # No account column needed since each sheet is for one bank
@@ -243,9 +330,11 @@ def append_transactions_to_sheet(service, transactions_data, sheet_name):
         ).execute()
         
         print(f"[OK] Added {len(transactions_data)} transactions to sheet '{sheet_name}'")
+        return True
         
     except Exception as e:
         print(f"[ERROR] Error appending to sheet '{sheet_name}': {e}")
+        return False
 
 def main():
     print("=== Finance Tracker Sync ===")
@@ -270,68 +359,129 @@ def main():
     
     print("[OK] Google Sheets service authenticated")
     
-    # Get all existing transaction IDs from all sheets
-    all_existing_ids = get_all_existing_transaction_ids(service, bank_manager)
-    print(f"Found {len(all_existing_ids)} existing transactions across all sheets")
+    # Local index of transaction IDs already written to the sheets
+    txn_index = TransactionIndex()
+    known_count = txn_index.count()
+    print(f"Found {known_count} known transactions in local index")
     
-    # Fetch recent transactions from all bank accounts
+    # Fetch transaction updates from all bank accounts
     print("Fetching recent transactions from all bank accounts...")
-    start_date = (datetime.datetime.now() - datetime.timedelta(days=60)).date()
-    end_date = datetime.datetime.now().date()
+    start_date = (datetime.datetime.now() - datetime.timedelta(days=INITIAL_SYNC_DAYS)).date()
     
     total_new_transactions = 0
     
-    # Process each bank account
-    for account_id, access_token, account_name in bank_manager.get_all_access_tokens():
-        print(f"\nProcessing {account_name}...")
-        
-        # Get account data to find sheet name
-        account_data = bank_manager.get_account_info(account_id)
-        sheet_name = account_data.get('sheet_name', account_name)
-        
-        # Create sheet if it doesn't exist
-        create_sheet_if_not_exists(service, sheet_name)
-        
-        # Get existing transactions for this specific sheet
-        sheet_existing_ids = get_existing_transaction_ids(service, sheet_name)
-        
-        try:
-            txn_req = TransactionsGetRequest(access_token=access_token, start_date=start_date, end_date=end_date)
-            txn_resp = client.transactions_get(txn_req)
-            transactions = txn_resp.transactions
-            print(f"  Fetched {len(transactions)} transactions")
-            
-            # Process and categorize transactions
-            account_new_transactions = []
+    # Start every account's first Plaid page up front so the per-account
+    # round-trips overlap; the Sheets calls below stay on this thread
+    bank_tokens = bank_manager.get_all_access_tokens()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(bank_tokens), MAX_FETCH_WORKERS)))
+    pending_fetches = {
+        account_id: executor.submit(fetch_transactions_page, access_token, bank_manager.get_sync_cursor(account_id))
+        for account_id, access_token, _ in bank_tokens
+    }
+    
+    # Make sure every account has its sheet, creating the missing ones together
+    sheet_names = [
+        bank_manager.get_account_info(account_id).get('sheet_name', account_name)
+        for account_id, _, account_name in bank_tokens
+    ]
+    created_sheets = create_missing_sheets(service, sheet_names)
+    
+    # A new sheet holds nothing but its header row
+    prefetched_ids = {sheet_name: set() for sheet_name in created_sheets}
+    
+    # An empty index (first run, or a deleted .txn_index.db) means every
+    # sheet would be read; read the existing ones in one request instead
+    if known_count == 0:
+        existing_sheets = list(dict.fromkeys(name for name in sheet_names if name not in created_sheets))
+        prefetched_ids.update(get_all_existing_transaction_ids(service, existing_sheets))
+        for sheet_name, ids in prefetched_ids.items():
+            txn_index.add(sheet_name, ids)
+    
+    # Process each bank account; last-sync, cursor and window updates are
+    # persisted in one write when the block exits
+    with bank_manager.bulk():
+        for account_id, access_token, account_name in bank_tokens:
+            print(f"\nProcessing {account_name}...")
             
-            for t in transactions:
-                if t.transaction_id not in sheet_existing_ids:
-                    tags = categorize_transaction(t)
-                    # Row format: [transaction_id, date, name, amount, category, project]
-                    row = [t.transaction_id, t.date.isoformat(), t.name, t.amount, tags["category"], tags["project"]]
-                    account_new_transactions.append(row)
+            # Get account data to find sheet name
+            account_data = bank_manager.get_account_info(account_id)
+            sheet_name = account_data.get('sheet_name', account_name)
+            window_start = bank_manager.get_sync_window_start(account_id)
+            if window_start is None:
+                # Fix the window on the first sync; Plaid keeps delivering older
+                # history as added transactions on later calls, after the cursor is stored
+                window_start = start_date
+                bank_manager.update_sync_window_start(account_id, window_start)
             
-            if account_new_transactions:
-                print(f"  Found {len(account_new_transactions)} new transactions")
-                # Append to this bank's sheet
-                append_transactions_to_sheet(service, account_new_transactions, sheet_name)
-                total_new_transactions += len(account_new_transactions)
+            try:
+                account_new_count = 0
+                samples = []
+                sheet_existing_ids = None
+                all_appended = True
+                next_cursor = None
                 
-                # Show sample transactions
-                print(f"  Sample transactions:")
-                for t in account_new_transactions[:3]:
-                    print(f"    {t[2]} - ${t[3]} ({t[4]})")
-                if len(account_new_transactions) > 3:
-                    print(f"    ... and {len(account_new_transactions) - 3} more")
+                # Categorize and upload page by page, so only one page of
+                # transactions is held in memory at a time
+                for page in iter_sync_pages(pending_fetches[account_id].result(), access_token):
+                    next_cursor = page.next_cursor
+                    # Plaid returns up to two years of history; keep the account's window
+                    transactions = [t for t in page.added if t.date >= window_start]
+                    print(f"  Fetched {len(transactions)} transactions")
+                    
+                    # Only read the sheet when Plaid returned IDs the local index
+                    # doesn't know; those may still have been added to the sheet by hand
+                    unseen_ids = txn_index.filter_unseen([t.transaction_id for t in transactions])
+                    if not unseen_ids:
+                        continue
+                    if sheet_existing_ids is None:
+                        if sheet_name in prefetched_ids:
+                            sheet_existing_ids = prefetched_ids[sheet_name]
+                        else:
+                            # The index knows every row written before this one; new rows are
+                            # appended at the bottom, so only the tail of the sheet can hold
+                            # IDs it hasn't seen
+                            start_row = max(1, txn_index.count(sheet_name) + 2 - EXISTING_IDS_TAIL_ROWS)
+                            sheet_existing_ids = get_existing_transaction_ids(service, sheet_name, start_row)
+                    txn_index.add(sheet_name, unseen_ids & sheet_existing_ids)
+                    transactions = [t for t in transactions if t.transaction_id in unseen_ids]
+                    
+                    new_rows = build_new_transaction_rows(transactions, sheet_existing_ids)
+                    for batch in iter_batches(new_rows):
+                        if append_transactions_to_sheet(service, batch, sheet_name):
+                            txn_index.add(sheet_name, (row[0] for row in batch))
+                        else:
+                            all_appended = False
+                        account_new_count += len(batch)
+                        if len(samples) < 3:
+                            samples.extend(batch[:3 - len(samples)])
                 
-                # Update last sync timestamp
-                bank_manager.update_last_sync(account_id)
-            else:
-                print(f"  No new transactions")
+                # Only advance the cursor once every row made it to the sheet,
+                # so a failed upload is retried on the next run
+                if all_appended and next_cursor:
+                    bank_manager.update_sync_cursor(account_id, next_cursor)
                 
-        except Exception as e:
-            print(f"  [ERROR] Error fetching transactions from {account_name}: {e}")
-            continue
+                if account_new_count:
+                    print(f"  Found {account_new_count} new transactions")
+                    total_new_transactions += account_new_count
+                    
+                    # Show sample transactions
+                    print(f"  Sample transactions:")
+                    for t in samples:
+                        print(f"    {t[2]} - ${t[3]} ({t[4]})")
+                    if account_new_count > 3:
+                        print(f"    ... and {account_new_count - 3} more")
+                    
+                    # Update last sync timestamp
+                    bank_manager.update_last_sync(account_id)
+                else:
+                    print(f"  No new transactions")
+                    
+            except Exception as e:
+                print(f"  [ERROR] Error fetching transactions from {account_name}: {e}")
+                continue
+    
+    executor.shutdown()
+    txn_index.close()
     
     print(f"\n[OK] Sync completed successfully!")
     print(f"Total new transactions processed: {total_new_transactions}")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local Transaction Index
+Remembers which transaction IDs are already in Google Sheets so a sync
+only has to read a sheet when Plaid returns IDs we haven't seen yet
+"""
+
+import sqlite3
+from typing import Iterable, Optional, Set
+
+class TransactionIndex:
+    def __init__(self, db_file: str = '.txn_index.db'):
+        self.db_file = db_file
+        self.conn = self._connect()
+
+    def _connect(self):
+        """Open the index database, or return None to fall back to Sheets-only"""
+        try:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute('CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, sheet_name TEXT)')
+            conn.commit()
+            return conn
+        except Exception as e:
+            print(f"[WARNING] Could not open transaction index {self.db_file}: {e}")
+            return None
+
+    def count(self, sheet_name: Optional[str] = None) -> int:
+        """Number of transaction IDs in the index, optionally for one sheet"""
+        if self.conn is None:
+            return 0
+        if sheet_name is None:
+            return self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        return self.conn.execute('SELECT COUNT(*) FROM seen WHERE sheet_name = ?', (sheet_name,)).fetchone()[0]
+
+    def filter_unseen(self, transaction_ids: Iterable[str]) -> Set[str]:
+        """Return the subset of transaction IDs that are not in the index"""
+        ids = set(transaction_ids)
+        if self.conn is None or not ids:
+            return ids
+
+        seen = set()
+        id_list = list(ids)
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(id_list), 500):
+            chunk = id_list[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f'SELECT id FROM seen WHERE id IN ({placeholders})', chunk)
+            seen.update([row[0] for row in rows])
+        return ids - seen
+
+    def add(self, sheet_name: str, transaction_ids: Iterable[str]):
+        """Record transaction IDs as present in a sheet"""
+        if self.conn is None:
+            return
+        try:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO seen (id, sheet_name) VALUES (?, ?)',
+                ((transaction_id, sheet_name) for transaction_id in transaction_ids)
+            )
+            self.conn.commit()
+        except Exception as e:
+            print(f"[WARNING] Could not update transaction index: {e}")
+
+    def close(self):
+        """Close the index database"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None